@@ -1,24 +1,34 @@
 import os
+import re
+import asyncio
 import logging
 
 from dotenv import load_dotenv
 
+# Faster drop-in event loop, available on Linux and macOS only
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Telegram api imports
 # ref: https://docs.python-telegram-bot.org/
-from telegram import Update
+from telegram import InputFile, Update
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     ContextTypes,
     CommandHandler,
     MessageHandler,
     filters,
 )
+from telegram.request import HTTPXRequest
 
 # Cat images api import
 import cat
 
 # Open-meteo module import
-from open_meteo import geocoding_search_city, scrape_weather_data, scrape_historic_weather_data
+from open_meteo import CityNotFound, close_client, geocoding_search_city, scrape_weather_data, scrape_historic_weather_data
 
 
 # logging
@@ -30,6 +40,9 @@ logger = logging.getLogger(__name__)
 # Disables log clutter due to lots of httpx calls
 logging.getLogger("httpx").disabled = True
 
+# Leading /current command, optionally addressed to the bot as /current@bot_name
+_CURRENT_CMD_RE = re.compile(r"^/current(?:@\w+)?\s*")
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -62,22 +75,22 @@ async def weather_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.args:
         city_name = " ".join(context.args).strip()
     else:
-        city_name = update.message.text.replace("/current", "").strip() if update.message and update.message.text else None
+        city_name = _CURRENT_CMD_RE.sub("", update.message.text, count=1).strip() if update.message and update.message.text else None
 
     if not city_name:
         logger.info("%s User did not specify a city name", update.effective_user.id)
         await update.message.reply_text("❗ An error occurred. Please provide a valid city name after the /current command.")
         return
     
-    logger.info(f"Received city query for %s", city_name)
+    logger.info("Received city query for %s", city_name)
 
     try:
-        city_data = geocoding_search_city(city_name)
-        weather_data = scrape_weather_data(
+        city_data = await geocoding_search_city(city_name)
+        weather_data = await scrape_weather_data(
             city_data.get("latitude"), city_data.get("longitude")
         )
 
-        logger.info(f"Successfully pulled weather data from API: %s", weather_data)
+        logger.info("Successfully pulled weather data from API: %s", weather_data)
 
         await update.message.reply_text(
             f"*📍 Location found: {city_name}*\n"
@@ -91,9 +104,11 @@ async def weather_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode="Markdown",
         )
 
-
+    except CityNotFound:
+        logger.info("City not found: %s", city_name)
+        await update.message.reply_text(f"❗ City not found: {city_name}")
     except Exception as e:
-        logger.error(f"Error fetching weather data for %s: %s", city_name, e)
+        logger.error("Error fetching weather data for %s: %s", city_name, e)
         await update.message.reply_text(
             "An error occurred while retrieving weather data."
         )
@@ -114,24 +129,26 @@ async def weather_weekly_plot_command(update: Update, context: ContextTypes.DEFA
         return
 
     
-    logger.info(f"Received historic city query for %s", city_name)
+    logger.info("Received historic city query for %s", city_name)
 
     try:
-        city_data = geocoding_search_city(city_name)
-        plot_image_path = scrape_historic_weather_data(
+        city_data = await geocoding_search_city(city_name)
+        plot_image = await scrape_historic_weather_data(
             city_data.get("latitude"), city_data.get("longitude")
         )
-        logger.info(f"Successfully generated plot and saved at: %s", plot_image_path)
-        await update.message.reply_photo(plot_image_path, caption="Here's a 1 week historic plot ☝")
+        logger.info("Successfully generated plot: %s bytes", len(plot_image))
+        await update.message.reply_photo(
+            InputFile(plot_image, filename="historic_weather_plot.png"),
+            caption="Here's a 1 week historic plot ☝",
+        )
+    except CityNotFound:
+        logger.info("City not found: %s", city_name)
+        await update.message.reply_text(f"❗ City not found: {city_name}")
     except Exception as e:
         logger.error("Error fetching historic weather data for %s: %s", city_name, e)
         await update.message.reply_text(
             "An error occured while retrieving historic weather data 😢"
         )
-    finally:
-        if os.path.exists(plot_image_path):
-            os.remove(plot_image_path)
-            logger.info("Successfully removed leftover files: %s", plot_image_path)
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -142,7 +159,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         update (Update): Incoming update containing a user message.
         context (ContextTypes.DEFAULT_TYPE): Contextual information about the update.
     """
-    logger.info(f"%s User issues a /help command", update.effective_user.id)
+    logger.info("%s User issues a /help command", update.effective_user.id)
 
     await update.message.reply_text(
         "*What this bot can do?*❔\n\
@@ -184,37 +201,79 @@ async def cat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context (ContextTypes.DEFAULT_TYPE): Contextual information about the update.
     """
     logger.info(
-        f"%s User issued /cat command, downloading...", update.effective_user.id
+        "%s User issued /cat command, downloading...", update.effective_user.id
     )
 
     await update.message.reply_text("Fetching image, it may take a while 🐱‍💻")
 
+    cat_image_path = None
     try:
         cat_image_path = cat.getCat(format="png")
         await update.message.reply_photo(
             cat_image_path, caption="Here's a random cat pic 🐈"
         )
     except Exception as e:
-        logger.error(f"Got an exception during image download:\n%s", e)
+        logger.error("Got an exception during image download:\n%s", e)
         await update.message.reply_text(
             "Sorry, I can't get you a pic of a cat this time 😿"
         )
     finally:
-        if os.path.exists(cat_image_path):
+        if cat_image_path and os.path.exists(cat_image_path):
             os.remove(cat_image_path)
             logger.info("Successfully removed leftover files %s: ", cat_image_path)
 
 
+async def post_shutdown(application: Application) -> None:
+    """
+    Releases shared resources once the bot stops
+
+    Args:
+        application (Application): The running bot application.
+    """
+    await close_client()
+
+
 def main() -> None:
     """
-    Loads environment variables, configures the bot, and starts polling for updates.
+    Loads environment variables, configures the bot, and starts receiving updates.
+
+    Updates are pushed by Telegram to a webhook when WEBHOOK_URL is set, otherwise the bot falls back to polling.
     """
     load_dotenv()
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        logger.info("Using uvloop event loop")
+
+    token = os.environ.get("TG_API_TOKEN")
+    webhook_url = os.environ.get("WEBHOOK_URL")
     application = (
         Application.builder()
-        .token(os.environ.get("TG_API_TOKEN"))
-        .read_timeout(10)
-        .connect_timeout(10)
+        .token(token)
+        # Keep-alive pool over HTTP/2, concurrent replies share the same connection to the Bot API
+        .request(
+            HTTPXRequest(
+                connection_pool_size=64,
+                http_version="2",
+                pool_timeout=5.0,
+                read_timeout=10,
+                connect_timeout=10,
+            )
+        )
+        .get_updates_request(
+            HTTPXRequest(http_version="2", read_timeout=10, connect_timeout=10)
+        )
+        # Pace outgoing messages below Telegram limits instead of stalling on 429 responses
+        .rate_limiter(
+            AIORateLimiter(
+                overall_max_rate=30,
+                overall_time_period=1,
+                group_max_rate=20,
+                group_time_period=60,
+                max_retries=3,
+            )
+        )
+        .concurrent_updates(True)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
@@ -228,7 +287,16 @@ def main() -> None:
         MessageHandler(filters.TEXT & ~filters.COMMAND, weather_handler)
     )
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if webhook_url:
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=int(os.environ.get("WEBHOOK_PORT", 8443)),
+            url_path=token,
+            webhook_url=f"{webhook_url.rstrip('/')}/{token}",
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
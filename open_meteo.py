@@ -1,26 +1,276 @@
+import asyncio
+import io
+import math
+import multiprocessing
+import time
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from async_lru import alru_cache
 import openmeteo_requests
+import requests
 import requests_cache
 from retry_requests import retry
-import httpx as requests
-import pandas
-import matplotlib.pyplot as plt
+import httpx
+import numpy
+import orjson
+from PIL import Image, ImageDraw, ImageFont
+
+
+class CityNotFound(Exception):
+    """
+    Raised when the geocoding API has no results for the requested city.
+    """
+
+
+# Shared clients and the plot pool are built on first use, so plot worker processes
+# importing this module do not open connections, the cache database or pools of their own
+_client: Optional[httpx.AsyncClient] = None
+_CACHE: Optional[requests_cache.CachedSession] = None
+_OM: Optional[openmeteo_requests.Client] = None
+_PLOT_POOL: Optional[ProcessPoolExecutor] = None
+
+
+def _http_client() -> httpx.AsyncClient:
+    """
+    Shared async HTTP client, keeps TCP/TLS connections alive between bot requests.
+    """
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            http2=True,
+            # Compressed responses, httpx decodes brotli via the brotli package
+            headers={"Accept-Encoding": "br, gzip"},
+            timeout=10,
+            limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+        )
+    return _client
+
+
+def _open_meteo_client() -> openmeteo_requests.Client:
+    """
+    Open-Meteo API client with cache and retry on error, every call reuses the same session.
+    """
+    global _CACHE, _OM
+    if _OM is None:
+        _CACHE = requests_cache.CachedSession(".cache", expire_after=3600)
+        _OM = openmeteo_requests.Client(session=retry(_CACHE, retries=5, backoff_factor=0.2))
+    return _OM
+
+
+def _plot_pool() -> ProcessPoolExecutor:
+    """
+    Plot rendering is CPU-bound, so it runs in worker processes instead of the event loop.
+
+    Workers are spawned rather than forked, the bot process already runs threads at that point.
+    """
+    global _PLOT_POOL
+    if _PLOT_POOL is None:
+        _PLOT_POOL = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+    return _PLOT_POOL
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket for upstream calls, its rate grows slowly on success and halves when upstream throttles.
+
+    Args:
+        rate (float): Initial amount of requests per second.
+        min_rate (float): Rate never drops below this value.
+        max_rate (float): Rate never grows above this value.
+        increase (float): Rate step added after success_threshold consecutive successes.
+        success_threshold (int): Consecutive successes required to increase the rate.
+    """
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float, increase: float = 0.5, success_threshold: int = 20):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.success_threshold = success_threshold
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._successes = 0
+        # Created on first use, on Python 3.9 a lock is bound to the loop current at creation time
+        self._lock = None
+
+    @property
+    def capacity(self) -> float:
+        """
+        Bucket size, always fits at least one token so rates below 1 per second still let calls through.
+        """
+        return max(1.0, self.rate)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        """
+        Waits until a token is available and takes it.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def on_success(self) -> None:
+        """
+        Reports a successful upstream call.
+        """
+        self._successes += 1
+        if self._successes >= self.success_threshold:
+            self._successes = 0
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self) -> None:
+        """
+        Reports a throttled (429) or failed (5xx) upstream call.
+        """
+        self._successes = 0
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._refill()
+        self._tokens = 0
+
+
+# One limiter per upstream host, Open-Meteo free tier allows 600 calls per minute
+_GEOCODING_LIMITER = AdaptiveRateLimiter(rate=5, min_rate=0.5, max_rate=10)
+_AIR_QUALITY_LIMITER = AdaptiveRateLimiter(rate=5, min_rate=0.5, max_rate=10)
+
+# Upstream calls currently in progress, concurrent duplicate requests share a single one
+_inflight: dict[tuple, asyncio.Future] = {}
+
+
+async def close_client() -> None:
+    """
+    Closes the shared HTTP clients, should be called once on bot shutdown.
+    """
+    global _client, _CACHE, _OM, _PLOT_POOL
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    if _CACHE is not None:
+        _CACHE.close()
+        _CACHE = _OM = None
+    if _PLOT_POOL is not None:
+        # Do not block the event loop waiting for workers to exit
+        _PLOT_POOL.shutdown(wait=False, cancel_futures=True)
+        _PLOT_POOL = None
+
+
+async def _singleflight(key: tuple, func, *args):
+    """
+    Runs func(*args) once per key, callers arriving while it is in flight await the same result.
+
+    Args:
+        key (tuple): Identifies duplicate requests.
+        func: Coroutine function doing the actual upstream call.
+    """
+    fut = _inflight.get(key)
+    if fut is not None:
+        # shield, so a cancelled follower does not cancel the shared call
+        return await asyncio.shield(fut)
+
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    try:
+        result = await func(*args)
+    except asyncio.CancelledError:
+        # Only the leader was cancelled, followers get a regular error they can report to the user
+        fut.set_exception(RuntimeError("upstream call cancelled"))
+        fut.exception()
+        raise
+    except Exception as e:
+        fut.set_exception(e)
+        # Mark as retrieved, nobody may be waiting on it
+        fut.exception()
+        raise
+    else:
+        fut.set_result(result)
+        return result
+    finally:
+        del _inflight[key]
+
+
+async def _fetch_air_quality(url: str, params: dict) -> list:
+    """
+    Calls the Open-Meteo Air Quality API through the rate limiter, the SDK client is blocking so it runs in a thread.
+
+    Args:
+        url (str): Air Quality API endpoint.
+        params (dict): Query params to scrape weather data.
+    """
+    statuses = []
+
+    def record_status(response, *args, **kwargs):
+        statuses.append(response.status_code)
+
+    await _AIR_QUALITY_LIMITER.acquire()
+    try:
+        responses = await asyncio.to_thread(_open_meteo_client().weather_api, url, params, hooks={"response": record_status})
+    except requests.exceptions.RetryError:
+        # The session gave up retrying 5xx responses
+        _AIR_QUALITY_LIMITER.on_throttle()
+        raise
+    except Exception:
+        # Only upstream throttling or server errors slow us down, not timeouts or bad requests
+        if statuses and (statuses[-1] == 429 or statuses[-1] >= 500):
+            _AIR_QUALITY_LIMITER.on_throttle()
+        raise
+    _AIR_QUALITY_LIMITER.on_success()
+    return responses
 
 
 # ref: https://open-meteo.com/en/docs
 # Lookup city coordinates using geocoding api by open-meteo
-def geocoding_search_city(city: str) -> dict:
+async def geocoding_search_city(city: str) -> dict:
     """
     Retrieve geographic coordinates (latitude, longitude) for a given city name.
 
     Args:
             city (str): Name of the city to look up.
     """
-    url = f"https://geocoding-api.open-meteo.com/v1/search?name={city}&count=1&format=json"
-    response = requests.get(url=url)
-    return response.json().get("results")[0]
+    name = city.strip()
+    return await _geocoding_search_cached(_CityQuery(key=name.casefold(), name=name))
 
 
-def scrape_weather_data(latitude: float, longitude: float) -> dict:
+@dataclass(frozen=True)
+class _CityQuery:
+    """
+    Geocoding query, compared and hashed by the normalized key only, so it works as cache key.
+    The name is sent to the API as the user typed it, casefold() may change spelling (Gießen -> giessen).
+    """
+
+    key: str
+    name: str = field(compare=False)
+
+
+# City coordinates practically never change, so repeated lookups are served from memory.
+# alru_cache also makes concurrent misses for the same city share one request
+@alru_cache(maxsize=4096, ttl=86400)
+async def _geocoding_search_cached(query: _CityQuery) -> dict:
+    city = query.name
+    url = "https://geocoding-api.open-meteo.com/v1/search"
+    await _GEOCODING_LIMITER.acquire()
+    response = await _http_client().get(url, params={"name": city, "count": 1, "format": "json"})
+    if response.status_code == 429 or response.is_server_error:
+        _GEOCODING_LIMITER.on_throttle()
+    else:
+        _GEOCODING_LIMITER.on_success()
+    response.raise_for_status()
+    results = orjson.loads(response.content).get("results") or []
+    if not results:
+        raise CityNotFound(city)
+    return results[0]
+
+
+async def scrape_weather_data(latitude: float, longitude: float) -> dict:
     """
     Fetches air quality weather data for given geographic coordinates using the Open-Meteo Air Quality API.
 
@@ -28,11 +278,6 @@ def scrape_weather_data(latitude: float, longitude: float) -> dict:
         latitude (float): The latitude of the location to fetch data for.
         longitude (float): The longitude of the location to fetch data for.
     """
-    # Setup the Open-Meteo API client with cache and retry on error
-    cache_session = requests_cache.CachedSession(".cache", expire_after=3600)
-    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-
-    openmeteo = openmeteo_requests.Client(session=retry_session)
     # Query params to scrape weather data
     url = "https://air-quality-api.open-meteo.com/v1/air-quality"
     params = {
@@ -42,25 +287,20 @@ def scrape_weather_data(latitude: float, longitude: float) -> dict:
     }
 
     # Process location.
-    responses = openmeteo.weather_api(url, params=params)
+    responses = await _singleflight(("current", latitude, longitude), _fetch_air_quality, url, params)
     response = responses[0]
-    current = response.Current()
-
-    weather_conditions = {}
-    weather_conditions["latitude"] = response.Latitude()
-    weather_conditions["longitude"] = response.Longitude()
-    weather_conditions["current_pm10"] = current.Variables(0).Value()
-    weather_conditions["current_pm2_5"] = current.Variables(1).Value()
-    weather_conditions["current_carbon_monoxide"] = current.Variables(2).Value()
-    weather_conditions["current_nitrogen_dioxide"] = current.Variables(3).Value()
+    variables = response.Current().Variables
 
-    return weather_conditions
-
-def scrape_historic_weather_data(latitude: float, longitude: float) -> str:
-    cache_session = requests_cache.CachedSession(".cache", expire_after=3600)
-    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
+    return {
+        "latitude": response.Latitude(),
+        "longitude": response.Longitude(),
+        "current_pm10": variables(0).Value(),
+        "current_pm2_5": variables(1).Value(),
+        "current_carbon_monoxide": variables(2).Value(),
+        "current_nitrogen_dioxide": variables(3).Value(),
+    }
 
-    openmeteo = openmeteo_requests.Client(session=retry_session)
+async def scrape_historic_weather_data(latitude: float, longitude: float) -> bytes:
     # Query params to scrape weather data
     url = "https://air-quality-api.open-meteo.com/v1/air-quality"
     params = {
@@ -70,44 +310,104 @@ def scrape_historic_weather_data(latitude: float, longitude: float) -> str:
 	    "past_days": 7
     }
 
-    responses = openmeteo.weather_api(url, params=params)
+    responses = await _singleflight(("hourly", latitude, longitude), _fetch_air_quality, url, params)
     response = responses[0]
     hourly = response.Hourly()
 
-    weather_hourly = {
-        "date": pandas.date_range(
-            start=pandas.to_datetime(hourly.Time(), unit="s", utc=True),
-            end=pandas.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
-            freq=pandas.Timedelta(seconds=hourly.Interval()),
-            inclusive="left"
-        ),
-        "pm10": hourly.Variables(0).ValuesAsNumpy(),
-        "pm2_5": hourly.Variables(1).ValuesAsNumpy(),
-        "carbon_monoxide": hourly.Variables(2).ValuesAsNumpy(),
-        "nitrogen_dioxide": hourly.Variables(3).ValuesAsNumpy(),
-    }
+    variables = hourly.Variables
+    pm10 = variables(0).ValuesAsNumpy()
 
-    hourly_dataframe = pandas.DataFrame(weather_hourly)
+    # Hourly timestamps straight from the response header, plotting needs no DataFrame
+    dates = numpy.datetime64(hourly.Time(), "s") + numpy.arange(len(pm10)) * numpy.timedelta64(hourly.Interval(), "s")
 
-    plt.figure(figsize=(15,6))
-    plt.plot(hourly_dataframe["date"], hourly_dataframe["pm10"],label="PM10")
-    plt.plot(hourly_dataframe["date"], hourly_dataframe["pm2_5"],label="PM2.5")
-    plt.plot(hourly_dataframe["date"], hourly_dataframe["carbon_monoxide"],label="CO")
-    plt.plot(hourly_dataframe["date"], hourly_dataframe["nitrogen_dioxide"],label="NO2")
+    return await asyncio.get_running_loop().run_in_executor(
+        _plot_pool(),
+        _render_plot,
+        dates,
+        pm10,
+        variables(1).ValuesAsNumpy(),
+        variables(2).ValuesAsNumpy(),
+        variables(3).ValuesAsNumpy(),
+    )
 
-    plt.xlabel("Date")
-    plt.ylabel("Concentration")
-    plt.title("Historic Air Quality Data (last 7 days)")
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
 
-    image_path = "historic_weather_plot.png"
-    plt.savefig(image_path)
-    plt.close()
+# Plot layout, series colors match matplotlib's default palette
+_PLOT_SIZE = (1500, 600)
+_PLOT_MARGINS = (70, 50, 20, 50)  # left, top, right, bottom
+_PLOT_SERIES = (("PM10", "#1f77b4"), ("PM2.5", "#ff7f0e"), ("CO", "#2ca02c"), ("NO2", "#d62728"))
+_PLOT_TITLE = "Historic Air Quality Data (last 7 days)"
+
+
+def _render_plot(dates, pm10, pm2_5, carbon_monoxide, nitrogen_dioxide) -> bytes:
+    """
+    Draws historic air quality plot and returns it as png image, runs inside a worker process.
+
+    Args:
+        dates: Timestamps shared by all series.
+        pm10, pm2_5, carbon_monoxide, nitrogen_dioxide: Hourly values for each metric.
+    """
+    series = (pm10, pm2_5, carbon_monoxide, nitrogen_dioxide)
+    width, height = _PLOT_SIZE
+    left, top = _PLOT_MARGINS[0], _PLOT_MARGINS[1]
+    right, bottom = width - _PLOT_MARGINS[2], height - _PLOT_MARGINS[3]
+
+    image = Image.new("RGB", _PLOT_SIZE, "white")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=14)
+
+    # All series share one concentration axis, missing hours are NaN
+    values = numpy.concatenate(series)
+    values = values[~numpy.isnan(values)]
+    low, high = (float(values.min()), float(values.max())) if values.size else (0.0, 1.0)
+    if high == low:
+        high = low + 1
+    x_scale = (right - left) / max(len(dates) - 1, 1)
+    y_scale = (bottom - top) / (high - low)
+
+    # Horizontal grid with concentration labels
+    for step in range(6):
+        value = low + (high - low) * step / 5
+        y = bottom - (value - low) * y_scale
+        draw.line([(left, y), (right, y)], fill="#dddddd")
+        draw.text((left - 8, y), f"{value:.0f}", fill="black", font=font, anchor="rm")
+
+    # Vertical grid at the first hour of every day
+    days = dates.astype("datetime64[D]")
+    for index in numpy.flatnonzero(days[1:] != days[:-1]) + 1:
+        x = left + index * x_scale
+        draw.line([(x, top), (x, bottom)], fill="#dddddd")
+        draw.text((x, bottom + 8), str(days[index]), fill="black", font=font, anchor="mt")
+
+    draw.rectangle([left, top, right, bottom], outline="black")
+
+    # Each series is drawn as polylines, broken where values are missing
+    for metric, (label, color) in zip(series, _PLOT_SERIES):
+        points = []
+        for index, value in enumerate(metric.tolist()):
+            if math.isnan(value):
+                if len(points) > 1:
+                    draw.line(points, fill=color, width=2)
+                points = []
+                continue
+            points.append((left + index * x_scale, bottom - (value - low) * y_scale))
+        if len(points) > 1:
+            draw.line(points, fill=color, width=2)
+
+    # Legend in the top right corner
+    for index, (label, color) in enumerate(_PLOT_SERIES):
+        y = top + 15 + index * 20
+        draw.line([(right - 110, y), (right - 80, y)], fill=color, width=3)
+        draw.text((right - 70, y), label, fill="black", font=font, anchor="lm")
+
+    draw.text((width / 2, top / 2), _PLOT_TITLE, fill="black", font=font, anchor="mm")
+    draw.text((left, top / 2), "Concentration", fill="black", font=font, anchor="lm")
+    draw.text((width / 2, height - 12), "Date", fill="black", font=font, anchor="mm")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+
+    return buffer.getvalue()
 
-    return image_path
-    
 
 def main() -> None:
     """This function implemented to debug this module separately from the TG bot
@@ -115,15 +415,26 @@ def main() -> None:
     It does not take any input and does not return any values, just checks basic functionality
     """
     city_name = input("Please enter city name:")
-    city_data = geocoding_search_city(city_name)
+    asyncio.run(debug_city(city_name))
+
+
+async def debug_city(city_name: str) -> None:
+    """
+    Runs all lookups for a single city on one event loop, so the shared client is reused
+
+    Args:
+        city_name (str): Name of the city to look up.
+    """
+    city_data = await geocoding_search_city(city_name)
 
-    hourly_dataframe = scrape_historic_weather_data(city_data.get("latitude"), city_data.get("longitude"))
-    print(hourly_dataframe)
+    plot_image = await scrape_historic_weather_data(city_data.get("latitude"), city_data.get("longitude"))
+    print(f"Rendered plot: {len(plot_image)} bytes")
     
-    weather_conditions = scrape_weather_data(
+    weather_conditions = await scrape_weather_data(
         city_data.get("latitude"), city_data.get("longitude")
     )
     print(city_name, city_data, weather_conditions)
+    await close_client()
 
 
 if __name__ == "__main__":